@@ -1,59 +1,91 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
+import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import re
+
+import mf_cache
+from hecbench_utils import discover_projects
+
+# Byte-level patterns so the file never goes through a UTF-8 decode/encode
+# round trip. Compiled once for all projects.
+RULES = {
+    "cxx": (re.compile(rb'(?m)^(\s*CC\s*=.*?)clang\+\+(.*)$'), rb'\1$(CXX)\2'),
+    "gpu": (re.compile(rb'(?m)^(\s*GPU\s*=.*?)yes(.*)$'), rb'\1$(USE_GPU)\2'),
+}
+
+# Which mf_cache flag tells whether a rule can match at all
+RULE_FLAGS = {"cxx": "has_clang", "gpu": "has_gpu_yes"}
+
+
+def patch_project(proj: Path, rules, dry_run: bool):
+    proj_name = proj.name
+    print(f"Enter ==> {proj_name}")
+    makefile = proj / "Makefile"
+
+    if makefile.exists():
+        # Consult the shared metadata cache first: if none of the selected
+        # rules can match, skip the open/mmap entirely.
+        info = mf_cache.get_info(makefile)
+        if not any(info[RULE_FLAGS[name]] for name in rules):
+            print("Exit")
+            return
+        # Dry runs must work on read-only checkouts, so only ask for write
+        # access when we may actually write.
+        with open(makefile, "rb" if dry_run else "r+b") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                print("Exit")
+                return
+            # mmap gives the regex a view of the page cache directly; no
+            # extra kernel->user copy of the whole file.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:]
+            total = 0
+            for name in rules:
+                pattern, repl = RULES[name]
+                data, n = pattern.subn(repl, data)
+                total += n
+            if total:
+                if dry_run:
+                    print(f"[dry-run] {total} substitution(s) in {makefile}")
+                else:
+                    # Only rewrite when something matched; unchanged files
+                    # keep their mtime and do not trigger rebuilds.
+                    f.seek(0)
+                    f.write(data)
+                    f.truncate()
+                    print("Content modified!")
+    else:
+        print(f'File not found: "{makefile}"')
+    print("Exit")
 
 
 def main():
     ap = argparse.ArgumentParser(description="modify all cmake *-sycl benchmarks.")
     ap.add_argument("--sycl-root", default=".", help="Root directory containing *-sycl projects (default: .)")
+    ap.add_argument("--rules", default="cxx,gpu", help="Comma-separated rules to apply: cxx (clang++ -> $(CXX)), gpu (GPU=yes -> $(USE_GPU)) (default: cxx,gpu)")
+    ap.add_argument("--dry-run", action="store_true", help="Report substitution counts without writing")
     args = ap.parse_args()
 
-    sycl_root = Path(args.sycl_root).resolve()
+    rules = [r.strip() for r in args.rules.split(",") if r.strip()]
+    unknown = [r for r in rules if r not in RULES]
+    if unknown:
+        print(f"Unknown rule(s): {', '.join(unknown)} (available: {', '.join(RULES)})", file=sys.stderr)
+        sys.exit(2)
 
-    # Discover projects
-    projects = sorted([p for p in sycl_root.glob("*-sycl") if p.is_dir()])
-    if not projects:
-        print(f"No projects found under {sycl_root} matching {args.pattern}", file=sys.stderr)
-        sys.exit(1)
+    sycl_root = Path(args.sycl_root).resolve()
+    mf_cache.set_cache_path(sycl_root / ".makefile_cache.json")
+    projects = discover_projects(sycl_root)
 
     start_time = time.time()
 
-    for proj in projects:
-        proj_name = proj.name
-        print(f"Enter ==> {proj_name}")
-        makefile = proj / "Makefile"
-
-        if makefile.exists():
-            with open(str(makefile), "r+") as mf:
-                lines = mf.readlines()
-                cc_line = -1
-                gpu_line = -1
-                new_cc_line = ""
-                new_gpu_line = ""
-                for i, line in enumerate(lines):
-                    if "CC" in line and "=" in line and "clang++" in line:
-                        cc_line = i
-                        new_cc_line = line.replace("clang++", "$(CXX)")
-                        continue
-                    if "GPU" in line and "=" in line and "yes" in line:
-                        gpu_line = i
-                        new_gpu_line = line.replace("yes", "$(USE_GPU)")
-                        break;
-                if cc_line >= 0:
-                    lines[cc_line] = new_cc_line
-                if gpu_line >= 0:
-                    lines[gpu_line] = new_gpu_line 
-                mf.seek(0)
-                for line in lines:
-                    mf.write(line)
-                mf.truncate()
-                print("Content modified!")
-        else:
-            print(f'File not found: "{makefile}"')
-        print("Exit")
-            
+    # The work is I/O-bound, so fan the reads/writes out over threads.
+    with ThreadPoolExecutor(max_workers=32) as ex:
+        list(ex.map(lambda p: patch_project(p, rules, args.dry_run), projects))
 
 
 if __name__ == "__main__":
@@ -1,33 +1,35 @@
 #!/usr/bin/env python3
 import argparse
-import sys
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import subprocess
+
+from hecbench_utils import discover_projects, run_subprocess
+
+
+def clean_one(proj: Path):
+    print(f"Enter ==> {proj.name}")
+    # -C avoids the os.chdir global-state hazard that precludes concurrency
+    run_subprocess(["make", "-C", str(proj), "clean"], quiet=True)
+    print("Exit")
 
 
 def main():
     ap = argparse.ArgumentParser(description="clean all *-sycl benchmarks.")
     ap.add_argument("--sycl-root", default=".", help="Root directory containing *-sycl projects (default: .)")
+    ap.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 4, help="Concurrent make clean invocations (default: cpu count)")
     args = ap.parse_args()
 
     sycl_root = Path(args.sycl_root).resolve()
-
-    # Discover projects
-    projects = sorted([p for p in sycl_root.glob("*-sycl") if p.is_dir()])
-    if not projects:
-        print(f"No projects found under {sycl_root} matching {args.pattern}", file=sys.stderr)
-        sys.exit(1)
+    projects = discover_projects(sycl_root)
 
     start_time = time.time()
 
-    for proj in projects:
-        proj_name = proj.name
-        print(f"Enter ==> {proj_name}")
-        os.chdir(proj) 
-        subprocess.call(["make", "clean"])
-        print(f"Exit")
+    # make's startup/Makefile parse dominates the trivial rm work, so overlap
+    # the invocations across a process pool.
+    with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+        list(ex.map(clean_one, projects))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Shared helpers for the *-sycl driver scripts."""
+import fnmatch
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import List
+
+
+def discover_projects(root: Path, pattern: str = "*-sycl") -> List[Path]:
+    # scandir's is_dir() reads d_type from getdents64 instead of issuing a
+    # stat per entry.
+    with os.scandir(root) as it:
+        projects = sorted(Path(e.path) for e in it
+                          if fnmatch.fnmatch(e.name, pattern) and e.is_dir(follow_symlinks=False))
+    if not projects:
+        print(f"No projects found under {root} matching {pattern}", file=sys.stderr)
+        sys.exit(1)
+    return projects
+
+
+def run_subprocess(cmd: List[str], quiet: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    if quiet:
+        kwargs.setdefault("stdout", subprocess.DEVNULL)
+        kwargs.setdefault("stderr", subprocess.DEVNULL)
+    return subprocess.run(cmd, check=False, **kwargs)
+
+
+def write_text(p: Path, text: str):
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Single-read Makefile metadata cache shared by the driver scripts.
+
+get_info() scans a Makefile once (targets, CC=clang++, GPU=yes) and memoizes
+the result keyed by (path, mtime_ns), so repeated tool invocations against an
+unchanged tree skip the read entirely. The cache persists as JSON at exit.
+"""
+import atexit
+import json
+import mmap
+import re
+import threading
+from pathlib import Path
+
+# One combined pass over the file: a target line, a CC=...clang++ line, or a
+# GPU=...yes line. Byte-level so the scan works on the mmap view directly.
+_SCAN_RE = re.compile(
+    rb'(?m)^(?:'
+    rb'(?P<target>[A-Za-z0-9_][A-Za-z0-9_.-]*)\s*:(?!=)'
+    rb'|(?P<clang>\s*CC\s*=.*?clang\+\+)'
+    rb'|(?P<gpu>\s*GPU\s*=.*?yes)'
+    rb')'
+)
+
+_cache = {}
+_cache_path = Path(".makefile_cache.json")
+_loaded = False
+_dirty = False
+_lock = threading.Lock()
+
+
+def set_cache_path(path: Path):
+    global _cache_path
+    _cache_path = Path(path)
+
+
+def _load():
+    global _loaded
+    _loaded = True
+    try:
+        _cache.update(json.loads(_cache_path.read_text()))
+    except (OSError, ValueError):
+        pass
+
+
+def _save():
+    if _dirty:
+        try:
+            _cache_path.parent.mkdir(parents=True, exist_ok=True)
+            _cache_path.write_text(json.dumps(_cache))
+        except OSError:
+            pass
+
+
+atexit.register(_save)
+
+
+def _scan(path: Path) -> dict:
+    targets = set()
+    has_clang = False
+    has_gpu_yes = False
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size:
+            f.seek(0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for m in _SCAN_RE.finditer(mm):
+                    if m.group("target") is not None:
+                        targets.add(m.group("target").decode("ascii", "ignore"))
+                    elif m.group("clang") is not None:
+                        has_clang = True
+                    else:
+                        has_gpu_yes = True
+    return {
+        "targets": sorted(targets),
+        "has_clang": has_clang,
+        "has_gpu_yes": has_gpu_yes,
+    }
+
+
+def get_info(path: Path) -> dict:
+    global _dirty
+    st = path.stat()
+    key = str(path)
+    with _lock:
+        if not _loaded:
+            _load()
+        entry = _cache.get(key)
+        if entry is not None and entry.get("mtime_ns") == st.st_mtime_ns:
+            return entry
+    info = _scan(path)
+    info["mtime_ns"] = st.st_mtime_ns
+    with _lock:
+        _cache[key] = info
+        _dirty = True
+    return info
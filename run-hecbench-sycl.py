@@ -1,66 +1,121 @@
 #!/usr/bin/env python3
 import argparse
+import atexit
 import csv
 import json
 import os
-import re
+import queue
 import shlex
 import stat
 import subprocess
 import sys
 import signal
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import List, Optional
+
+import mf_cache
+from hecbench_utils import discover_projects
 
 # ---------- helpers ----------
 
-def run(cmd: List[str], cwd: Path, timeout: int, env: Optional[dict] = None) -> Tuple[int, str, str]:
-    p = subprocess.Popen(
-        cmd,
-        cwd=str(cwd),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        env=env,
-        start_new_session=True
-    )
+# process_group (3.11+) puts the child in its own group without detaching it
+# from the controlling session, so TTY Ctrl-C semantics stay intact.
+if sys.version_info >= (3, 11):
+    _POPEN_GROUP_KWARGS = {"process_group": 0}
+else:
+    _POPEN_GROUP_KWARGS = {"start_new_session": True}
 
+def _kill_tree(p: subprocess.Popen, grace: float = 2.0):
+    # Polite kill: SIGTERM with a grace period so children can clean up,
+    # then SIGKILL the whole group.
     try:
-        out, err = p.communicate(timeout=timeout)
-        return p.returncode, out, err
-
+        os.killpg(p.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        p.wait(timeout=grace)
     except subprocess.TimeoutExpired:
+        pass
+    try:
         os.killpg(p.pid, signal.SIGKILL)
-        out, err = p.communicate()
-        return 124, out, err + "\n[TIMEOUT]\n"
+    except ProcessLookupError:
+        pass
+    p.wait()
 
-    except KeyboardInterrupt:
-        print("\n[INTERRUPTED] Killing subprocess...")
-        os.killpg(p.pid, signal.SIGKILL)
-        p.wait()
-        raise  # re-raise so main program stops
+# Process group of the build/run child currently owned by this worker, so
+# the SIGTERM handler installed by worker_init can take it down with us.
+_current_child_pgid = None
+
+def run(cmd: List[str], cwd: Path, timeout: int, log_path: Path,
+        env: Optional[dict] = None, header: str = "") -> int:
+    global _current_child_pgid
+    # Stream child output straight to the on-disk log instead of buffering it
+    # through a pipe; log size no longer inflates worker RSS, and the log is
+    # tail-able while the build is still running.
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "wb") as f:
+        if header:
+            f.write(header.encode())
+            f.flush()
+        p = subprocess.Popen(
+            cmd,
+            cwd=str(cwd),
+            stdout=f,
+            stderr=f,
+            env=env,
+            **_POPEN_GROUP_KWARGS
+        )
+        _current_child_pgid = p.pid
+
+        try:
+            code = p.wait(timeout=timeout)
+
+        except subprocess.TimeoutExpired:
+            _kill_tree(p)
+            f.write(b"\n[TIMEOUT]\n")
+            code = 124
+
+        except KeyboardInterrupt:
+            print("\n[INTERRUPTED] Killing subprocess...")
+            _kill_tree(p, grace=0.5)
+            raise  # re-raise so main program stops
+
+        finally:
+            _current_child_pgid = None
 
-def list_targets(make_tool: str, proj_dir: Path, timeout: int) -> List[str]:
-    # Parse targets from `make -qp`. This prints make database; targets are lines ending with ':'
-    code, out, err = run([make_tool, "-qp"], proj_dir, timeout)
-    if code != 0:
+        f.write(f"\n[exit] {code}\n".encode())
+    return code
+
+def list_targets(proj_dir: Path) -> List[str]:
+    # Targets come from the shared Makefile metadata cache, so an unchanged
+    # Makefile is read at most once across tool invocations.
+    makefile = proj_dir / "Makefile"
+    if not makefile.exists():
         return []
-    # Avoid pattern rules; keep simple identifiers
-    targets = set()
-    for line in out.splitlines():
-        # target: (not starting with a dot unless the target is exactly '.PHONY')
-        if ":" in line and not line.startswith("\t"):
-            tgt = line.split(":", 1)[0].strip()
-            if " " in tgt or "/" in tgt or "%" in tgt or tgt == "":
-                continue
-            targets.add(tgt)
-    return sorted(targets)
-
-def has_target(targets: List[str], name: str) -> bool:
-    return name in targets
-
-def guess_executable(proj_dir: Path) -> Optional[Path]:
+    return mf_cache.get_info(makefile)["targets"]
+
+def guess_executable(proj_dir: Path, results_root: Optional[Path] = None) -> Optional[Path]:
+    # Memoize the resolved executable per project: the filesystem walk below
+    # is the expensive part, and the answer only changes when the project is
+    # rebuilt, which touches the Makefile mtime at configure time.
+    makefile = proj_dir / "Makefile"
+    cache_file = None
+    makefile_mtime_ns = None
+    if results_root is not None and makefile.exists():
+        makefile_mtime_ns = makefile.stat().st_mtime_ns
+        cache_file = results_root / proj_dir.name / ".exe_cache.json"
+        try:
+            cached = json.loads(cache_file.read_text())
+            if cached.get("makefile_mtime_ns") == makefile_mtime_ns:
+                exe = Path(cached["exe"])
+                if exe.is_file() and os.access(exe, os.X_OK):
+                    return exe
+        except (OSError, ValueError, KeyError):
+            pass
+
     # Prefer executables in ./bin (depth 1)
     candidates: List[Path] = []
     bin_dir = proj_dir / "bin"
@@ -71,72 +126,116 @@ def guess_executable(proj_dir: Path) -> Optional[Path]:
 
     # Also consider executables at project root (depth 1)
     for p in proj_dir.iterdir():
+        # Skip obvious non-targets before spending the access() syscall
+        if p.name.endswith((".sh", ".py", ".pl")):
+            continue
+        if p.suffix in (".o", ".a", ".so", ".dylib"):
+            continue
         if p.is_file() and os.access(p, os.X_OK):
-            # Skip obvious non-targets
-            if p.name.endswith((".sh", ".py", ".pl")):
-                continue
-            if p.suffix in (".o", ".a", ".so", ".dylib"):
-                continue
             candidates.append(p)
 
     # If still nothing, allow depth 2 (common: build/, out/)
     for parent in (proj_dir / "build", proj_dir / "out", proj_dir / "bin"):
         if parent.is_dir():
-            for p in parent.rglob("*"):
-                if p.is_file() and os.access(p, os.X_OK):
+            for dirpath, dirnames, filenames in os.walk(parent, followlinks=False):
+                for name in filenames:
+                    p = Path(dirpath) / name
+                    # Filter by extension before spending a syscall on access()
                     if p.suffix in (".sh", ".py", ".pl", ".o", ".a", ".so", ".dylib"):
                         continue
-                    candidates.append(p)
+                    if p.is_symlink():
+                        continue
+                    if p.is_file() and os.access(p, os.X_OK):
+                        candidates.append(p)
 
     if not candidates:
         return None
 
     # Choose the largest file (heuristic for “main” binary)
     candidates = list({c.resolve() for c in candidates})
-    candidates.sort(key=lambda p: (p.stat().st_size, p.stat().st_mtime), reverse=True)
-    return candidates[0]
+    def _key(p: Path):
+        st = p.stat()
+        return (st.st_size, st.st_mtime)
+    candidates.sort(key=_key, reverse=True)
+    best = candidates[0]
 
-def write_text(p: Path, text: str):
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(text)
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(
+            {"makefile_mtime_ns": makefile_mtime_ns, "exe": str(best)}))
+    return best
 
-# ---------- main ----------
+# ---------- background log writer ----------
 
-def main():
-    ap = argparse.ArgumentParser(description="Compile and test all *-sycl benchmarks.")
-    ap.add_argument("--sycl-root", default=".", help="Root directory containing *-sycl projects (default: .)")
-    ap.add_argument("--make", default="make", help="Make tool (default: make)")
-    ap.add_argument("--make-jobs", "-j", type=int, default=os.cpu_count() or 4, help="Parallel jobs for make")
-    ap.add_argument("--timeout-build", type=int, default=900, help="Build timeout per project in seconds (default: 900)")
-    ap.add_argument("--timeout-run", type=int, default=180, help="Run timeout per project in seconds (default: 60)")
-    ap.add_argument("--skip-run", action="store_true", help="Only compile (skip run/tests)")
-    ap.add_argument("--device-filter", default=None, help="Value for SYCL_DEVICE_FILTER if you want to set it")
-    ap.add_argument("--pattern", default="*-sycl", help="Glob to pick projects (default: *-sycl)")
-    ap.add_argument("--results-dir", default="sycl_test_results", help="Where to store logs/results")
-    ap.add_argument("--cflags-plus", default="", help="Append tokens to EXTRA_CFLAGS (passed to make as EXTRA_CFLAGS+=tok ...)")
-    args = ap.parse_args()
+# Small status logs (skip markers etc.) are committed by a daemon thread so
+# workers never block on the disk for them. Lazily started so each pool
+# worker gets its own thread after fork/spawn.
+_log_queue = None
 
-    sycl_root = Path(args.sycl_root).resolve()
+def _log_writer():
+    while True:
+        path, data = _log_queue.get()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        except OSError as e:
+            # Keep the thread alive: a dead writer would eventually fill the
+            # bounded queue and deadlock queue_log.
+            print(f"[WARN] could not write {path}: {e}", file=sys.stderr)
+        finally:
+            _log_queue.task_done()
+
+def _drain_logs():
+    if _log_queue is not None:
+        _log_queue.join()
+
+def queue_log(path: Path, text: str):
+    global _log_queue
+    if _log_queue is None:
+        _log_queue = queue.Queue(maxsize=256)
+        threading.Thread(target=_log_writer, daemon=True).start()
+        atexit.register(_drain_logs)
+    _log_queue.put((path, text.encode()))
+
+# ---------- per-project worker ----------
+
+def _worker_terminate(signum, frame):
+    # The parent SIGTERMs us on Ctrl-C; take the in-flight build/run tree
+    # down too (it lives in its own process group) and bail out.
+    if _current_child_pgid is not None:
+        try:
+            os.killpg(_current_child_pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    os._exit(1)
+
+def worker_init():
+    # Each worker gets its own process group so a Ctrl-C in the parent does not
+    # tear workers down mid-build; the parent terminates them explicitly.
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _worker_terminate)
+
+def process_project(proj: Path, args, run_env: dict, build_env: Optional[dict] = None) -> dict:
+    proj_name = proj.name
     results_root = Path(args.results_dir).resolve()
-    results_root.mkdir(parents=True, exist_ok=True)
-   
-    # Discover projects
-    projects = sorted([p for p in sycl_root.glob(args.pattern) if p.is_dir()])
-    if not projects:
-        print(f"No projects found under {sycl_root} matching {args.pattern}", file=sys.stderr)
-        sys.exit(1)
 
-    summary_rows = []
-    start_time = time.time()
+    makefile = proj / "Makefile"
+    log_dir = results_root / proj_name
+    build_log = log_dir / "build.log"
+    run_log = log_dir / "run.log"
+    worker_log = log_dir / "worker.log"
 
-    for proj in projects:
-        proj_name = proj.name
-        print(f"==> {proj_name}")
+    log_dir.mkdir(parents=True, exist_ok=True)
+    # Per-worker progress log; stdout redirection does not survive fork/spawn,
+    # so each project writes its own.
+    wl = worker_log.open("w")
+    def log(msg: str):
+        wl.write(msg + "\n")
+        wl.flush()
 
-        makefile = proj / "Makefile"
-        log_dir = results_root / proj_name
-        build_log = log_dir / "build.log"
-        run_log = log_dir / "run.log"
+    try:
+        log(f"==> {proj_name}")
 
         compiled_ok = False
         run_ok = False
@@ -146,88 +245,210 @@ def main():
         if not makefile.exists():
             failure_stage = "makefile_missing"
             note = "No Makefile"
-            write_text(build_log, "[SKIP] No Makefile found.\n")
-            summary_rows.append({
+            queue_log(build_log, "[SKIP] No Makefile found.\n")
+            return {
                 "benchmark": proj_name,
                 "compile": "SKIP",
                 "run": "SKIP",
                 "failure_stage": failure_stage,
                 "note": note,
-            })
-            continue
+            }
 
         # 1) Build
-        build_cmd = [args.make, f"-j{args.make_jobs}", "CXX=acpp", "USE_GPU=no", "VENDOR=AdaptiveCpp"]
-        if args.cflags_plus:
-            for tok in shlex.split(args.cflags_plus):
-                build_cmd.append(f"EXTRA_CFLAGS+={tok}")
-        code, out, err = run(build_cmd, proj, args.timeout_build)
-        write_text(build_log, f"$ {' '.join(shlex.quote(c) for c in build_cmd)}\n\n[stdout]\n{out}\n\n[stderr]\n{err}\n\n[exit] {code}\n")
+        build_header = f"$ {args.build_cmd_str}\n[cwd] {proj}\n\n"
+        code = run(args.build_cmd, proj, args.timeout_build, build_log, env=build_env, header=build_header)
         compiled_ok = (code == 0)
         if not compiled_ok:
             failure_stage = "compile"
             note = f"make exit {code}"
+            log(f"[FAIL] compile ({note})")
             # record and skip running
-            write_text(run_log, "[SKIP] Build failed; not running.\n")
-            summary_rows.append({
+            queue_log(run_log, "[SKIP] Build failed; not running.\n")
+            return {
                 "benchmark": proj_name,
                 "compile": "FAIL",
                 "run": "SKIP",
                 "failure_stage": failure_stage,
                 "note": note,
-            })
-            continue
+            }
 
         if args.skip_run:
-            summary_rows.append({
+            return {
                 "benchmark": proj_name,
                 "compile": "PASS",
                 "run": "SKIP",
                 "failure_stage": None,
                 "note": "run skipped",
-            })
-            continue
+            }
 
         # 2) Test/run
-        env = os.environ.copy()
-        if args.device_filter:
-            env["SYCL_DEVICE_FILTER"] = args.device_filter
-
         # Always run via `make run` (as requested)
         ran_via = "make run"
-        run_env = os.environ.copy()
-        if args.device_filter:
-            run_env["SYCL_DEVICE_FILTER"] = args.device_filter
-        run_cmd = [args.make]
-        if args.cflags_plus:
-            for tok in shlex.split(args.cflags_plus):
-                run_cmd.append(f"EXTRA_CFLAGS+={tok}")
-        run_cmd.append("run")
-        run_code, r_out, r_err = run(run_cmd, proj, args.timeout_run, env=run_env)
-
-        write_text(run_log, f"[via] {ran_via}\n\n[stdout]\n{r_out}\n\n[stderr]\n{r_err}\n\n[exit] {run_code}\n")
+        run_code = run(args.run_cmd, proj, args.timeout_run, run_log, env=run_env,
+                       header=f"[via] {ran_via}\n\n")
         run_ok = (run_code == 0)
         if not run_ok:
             failure_stage = "run"
             note = f"{ran_via or 'no-run'} exit {run_code}"
+            log(f"[FAIL] run ({note})")
 
-        summary_rows.append({
+        return {
             "benchmark": proj_name,
             "compile": "PASS" if compiled_ok else "FAIL",
             "run": "PASS" if run_ok else "FAIL",
             "failure_stage": failure_stage,
             "note": note,
-        })
+        }
+    finally:
+        # Pool workers exit via os._exit, which skips atexit, so drain any
+        # queued log writes before handing the row back.
+        _drain_logs()
+        wl.close()
+
+# ---------- main ----------
+
+def main():
+    ap = argparse.ArgumentParser(description="Compile and test all *-sycl benchmarks.")
+    ap.add_argument("--sycl-root", default=".", help="Root directory containing *-sycl projects (default: .)")
+    ap.add_argument("--make", default="make", help="Make tool (default: make)")
+    ap.add_argument("--projects-parallel", "-P", type=int, default=1, help="Number of projects to build/run concurrently (default: 1)")
+    ap.add_argument("--make-jobs", "-j", type=int, default=None, help="Parallel jobs for make (default: cpu_count // projects-parallel)")
+    ap.add_argument("--timeout-build", type=int, default=900, help="Build timeout per project in seconds (default: 900)")
+    ap.add_argument("--timeout-run", type=int, default=180, help="Run timeout per project in seconds (default: 60)")
+    ap.add_argument("--skip-run", action="store_true", help="Only compile (skip run/tests)")
+    ap.add_argument("--device-filter", default=None, help="Value for SYCL_DEVICE_FILTER if you want to set it")
+    ap.add_argument("--pattern", default="*-sycl", help="Glob to pick projects (default: *-sycl)")
+    ap.add_argument("--results-dir", default="sycl_test_results", help="Where to store logs/results")
+    ap.add_argument("--cflags-plus", default="", help="Append tokens to EXTRA_CFLAGS (passed to make as EXTRA_CFLAGS+=tok ...)")
+    cache_group = ap.add_mutually_exclusive_group()
+    cache_group.add_argument("--ccache", action="store_true", help="Wrap the compiler with ccache (cache stored under results-dir/.ccache)")
+    cache_group.add_argument("--sccache", action="store_true", help="Wrap the compiler with sccache")
+    args = ap.parse_args()
+
+    if args.projects_parallel < 1:
+        args.projects_parallel = 1
+    if args.make_jobs is None:
+        # Keep total cores ~= projects_parallel * make_jobs
+        args.make_jobs = max(1, (os.cpu_count() or 4) // args.projects_parallel)
+
+    sycl_root = Path(args.sycl_root).resolve()
+    results_root = Path(args.results_dir).resolve()
+    results_root.mkdir(parents=True, exist_ok=True)
+    # Keyed by sycl_root (not results-dir) so all tools touching the same
+    # tree share one cache regardless of where their results go.
+    mf_cache.set_cache_path(sycl_root / ".makefile_cache.json")
+
+    projects = discover_projects(sycl_root, args.pattern)
+
+    # Parse the EXTRA_CFLAGS tokens once rather than per project (and per
+    # stage) inside the workers.
+    args.cflags_tokens = shlex.split(args.cflags_plus) if args.cflags_plus else []
+
+    # Share one AdaptiveCpp JIT/kernel cache across all projects and
+    # invocations, so a second sweep (and repeated bench runs) skips the
+    # heavy back-end pass for unchanged kernels. HIPSYCL_APP_DB_DIR is the
+    # pre-rename spelling that older acpp releases still read.
+    acpp_cache_dir = results_root / ".acpp_cache"
+    acpp_cache_dir.mkdir(parents=True, exist_ok=True)
+    acpp_cache_env = {
+        "ACPP_APPDB_DIR": str(acpp_cache_dir),
+        "HIPSYCL_APP_DB_DIR": str(acpp_cache_dir),
+        "ACPP_PERSISTENT_RUNTIME_DEVICE_JIT_CACHE": "1",
+    }
+
+    # Optionally wrap the compiler with ccache/sccache so unchanged
+    # translation units skip compilation entirely on reruns. The first sweep
+    # populates the cache; Makefile-only edits still hit it thanks to
+    # CCACHE_COMPILERCHECK=content.
+    args.cxx = "acpp"
+    build_env = os.environ.copy()
+    build_env.update(acpp_cache_env)
+    if args.ccache:
+        args.cxx = "ccache acpp"
+        build_env["CCACHE_BASEDIR"] = str(sycl_root)
+        build_env["CCACHE_COMPILERCHECK"] = "content"
+        build_env["CCACHE_DIR"] = str(results_root / ".ccache")
+    elif args.sccache:
+        args.cxx = "sccache acpp"
+        build_env["SCCACHE_DIR"] = str(results_root / ".sccache")
+
+    # The make command lines only vary in cwd, so build them (and the
+    # shell-quoted log header) once here instead of per project.
+    args.build_cmd = [args.make, f"-j{args.make_jobs}", f"CXX={args.cxx}", "USE_GPU=no", "VENDOR=AdaptiveCpp"]
+    args.build_cmd += [f"EXTRA_CFLAGS+={tok}" for tok in args.cflags_tokens]
+    args.build_cmd_str = shlex.join(args.build_cmd)
+    args.run_cmd = [args.make] + [f"EXTRA_CFLAGS+={tok}" for tok in args.cflags_tokens] + ["run"]
+
+    # The environment is identical for every project; copy it once here
+    # instead of per project inside the workers. Dead weight under
+    # --skip-run, so skip it there too.
+    base_run_env = None
+    if not args.skip_run:
+        base_run_env = os.environ.copy()
+        base_run_env.update(acpp_cache_env)
+        if args.device_filter:
+            base_run_env["SYCL_DEVICE_FILTER"] = args.device_filter
+
+    summary_rows = []
+    start_time = time.time()
 
-    # Write summary
     csv_path = results_root / "results.csv"
     json_path = results_root / "results.json"
-    with csv_path.open("w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=["benchmark", "compile", "run", "failure_stage", "note"])
-        w.writeheader()
-        for row in summary_rows:
-            w.writerow(row)
+    partial_json_path = results_root / "results.partial.json"
+
+    # Append each row to results.csv as its project finishes, so a killed
+    # run (OOM, Ctrl-C mid-build) still leaves its progress on disk.
+    csv_file = csv_path.open("w", newline="")
+    atexit.register(csv_file.close)
+    writer = csv.DictWriter(csv_file, fieldnames=["benchmark", "compile", "run", "failure_stage", "note"])
+    writer.writeheader()
+    csv_file.flush()
+
+    try:
+        # Builds are independent, so dispatch projects across a process pool
+        # and collect rows as they complete.
+        with ProcessPoolExecutor(max_workers=args.projects_parallel, initializer=worker_init) as executor:
+            futures = {executor.submit(process_project, proj, args, base_run_env, build_env): proj for proj in projects}
+            try:
+                for fut in as_completed(futures):
+                    proj = futures[fut]
+                    print(f"==> {proj.name}")
+                    row = fut.result()
+                    summary_rows.append(row)
+                    writer.writerow(row)
+                    csv_file.flush()
+                    if len(summary_rows) % 25 == 0:
+                        partial_json_path.write_text(json.dumps(summary_rows, indent=2))
+            except KeyboardInterrupt:
+                # SIGTERM the worker process groups (pgid == worker pid via
+                # worker_init); each worker kills its in-flight build tree
+                # and exits. shutdown(wait=True) would block until running
+                # builds hit their timeouts.
+                for wp in list(executor._processes.values()):
+                    try:
+                        os.killpg(wp.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                executor.shutdown(wait=False, cancel_futures=True)
+                # Rows that finished before the interrupt but were not yet
+                # consumed by as_completed still belong in results.csv.
+                written = {r["benchmark"] for r in summary_rows}
+                for fut, proj in futures.items():
+                    if fut.done() and not fut.cancelled() and proj.name not in written:
+                        try:
+                            row = fut.result()
+                        except BaseException:
+                            continue
+                        summary_rows.append(row)
+                        writer.writerow(row)
+                csv_file.flush()
+                raise
+    finally:
+        csv_file.close()
+
+    summary_rows.sort(key=lambda r: r["benchmark"])
     json_path.write_text(json.dumps(summary_rows, indent=2))
+    partial_json_path.unlink(missing_ok=True)
 
     total = len(summary_rows)
     passed_both = sum(1 for r in summary_rows if r["compile"] == "PASS" and r["run"] == "PASS")
@@ -245,14 +466,8 @@ def main():
     print(f"Elapsed: {int(elapsed)}s")
 
 if __name__ == "__main__":
-    orig_stdout = sys.stdout
-    log_file = open('log.txt', 'w')
-    sys.stdout = log_file
     try:
         main()
     except KeyboardInterrupt:
         print("\nInterrupted by user.")
         sys.exit(130)
-    finally:
-        sys.stdout = orig_stdout
-        log_file.close()